@@ -4,219 +4,654 @@ Phase 7: Advanced Analytics Dashboard
 Calculate comprehensive metrics for business intelligence
 """
 
+import copy
+import os
+import json
 import logging
-from datetime import datetime, timedelta
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Confirmed bookings pre-aggregated per (created date, facility, start hour,
+# start weekday). Dashboard sections read this instead of scanning bookings.
+ROLLUP_TABLE = 'bookings_daily_rollup'
+
+# Dashboards poll the same windows repeatedly; serve results from memory
+# for this many seconds before hitting the database again
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', '30'))
+DASHBOARD_CACHE_MAX_ENTRIES = 64
+
+# Shared by every AdvancedAnalytics instance in the process, keyed by days:
+# {days: (expires_at, metrics, json_body or None until first encoded)}
+_dashboard_cache = {}
+_dashboard_cache_lock = threading.Lock()
+
+
+def _json_default(value):
+    """Encode driver types json/orjson don't handle natively"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def _dumps(payload) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload, default=_json_default)
+    return json.dumps(payload, default=_json_default).encode('utf-8')
+
+# Rebuilds rollup rows from confirmed bookings matching `where`
+_SQL_ROLLUP_INSERT = f"""
+    INSERT INTO {ROLLUP_TABLE} (date, facility_id, hour, dow, bookings, revenue)
+    SELECT 
+        DATE(created_at),
+        facility_id,
+        start_hour,
+        start_dow,
+        COUNT(*),
+        COALESCE(SUM(price), 0)
+    FROM bookings
+    WHERE {{where}}
+    AND status = 'confirmed'
+    GROUP BY DATE(created_at), facility_id, start_hour, start_dow
+    ON DUPLICATE KEY UPDATE
+        bookings = VALUES(bookings),
+        revenue = VALUES(revenue)
+"""
+
+# Rows pulled per round-trip when streaming series that grow with `days`
+FETCH_BATCH_SIZE = 512
+
+
+def _iter_rows(cursor, size: int = FETCH_BATCH_SIZE):
+    """Yield rows from an executed cursor in fetchmany() batches"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
+
+def _close_cursor(cursor):
+    """Drain unread rows, then close, so the connection can be reused"""
+    try:
+        while cursor.fetchmany(FETCH_BATCH_SIZE):
+            pass
+    except Exception:
+        pass  # no result set left (or the statement never ran)
+    cursor.close()
+
+
+# Server-side prepared cursors, one per (connection, statement), so repeat
+# dashboard loads send only parameters instead of re-parsing the SQL. A
+# connection is only used by one thread at a time, so its cursors are too.
+_prepared_cursors = weakref.WeakKeyDictionary()
+_prepared_cursors_lock = threading.Lock()
+
+
+def _connection_key(conn):
+    # Pool checkouts wrap the real connection in a fresh object each time
+    return getattr(conn, '_cnx', conn)
+
+
+def _discard_prepared_cursor(conn, sql: str):
+    """Forget and close the cached prepared cursor for `sql`, if any"""
+    with _prepared_cursors_lock:
+        cursor = _prepared_cursors.get(_connection_key(conn), {}).pop(sql, None)
+    if cursor is not None:
+        _close_cursor(cursor)
+
+
+# Replica connections whose session is already READ ONLY, READ COMMITTED.
+# A pool that resets sessions on checkout just reverts them to the server
+# default, which is still correct, only without the cheaper snapshots.
+_read_only_sessions = weakref.WeakSet()
+_read_only_sessions_lock = threading.Lock()
+
+
+def _ensure_read_only_session(conn):
+    """Mark the connection's session read-only with READ COMMITTED isolation"""
+    key = _connection_key(conn)
+    with _read_only_sessions_lock:
+        if key in _read_only_sessions:
+            return
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED, READ ONLY")
+    finally:
+        cursor.close()
+    
+    with _read_only_sessions_lock:
+        _read_only_sessions.add(key)
+
+
+def _execute_prepared(conn, sql: str, params: tuple):
+    """
+    Execute `sql` on its cached prepared cursor for this connection
+    
+    Re-prepares once if the server dropped the statement (e.g. when the pool
+    reset the session on checkout).
+    
+    Returns:
+        The executed cursor; rows must be fully read before the next call
+    """
+    for attempt in range(2):
+        with _prepared_cursors_lock:
+            cursors = _prepared_cursors.setdefault(_connection_key(conn), {})
+            cursor = cursors.get(sql)
+            if cursor is None:
+                cursor = cursors[sql] = conn.cursor(prepared=True)
+        
+        try:
+            cursor.execute(sql, params)
+            return cursor
+        except Exception:
+            _discard_prepared_cursor(conn, sql)
+            if attempt:
+                raise
+
+
+# Dashboard sections over the rollup, tagged and joined with UNION ALL so
+# they come back as one result set in one round-trip. A window of N days
+# covers today and the N-1 days before it; the previous period is the N
+# days before that.
+#
+# Every branch yields: section, key_int, key_date, bookings, amount,
+# previous_bookings, sort_key
+SECTION_OVERVIEW = 0
+SECTION_REVENUE_BY_FACILITY = 1
+SECTION_REVENUE_BY_DATE = 2
+SECTION_UTILIZATION = 3
+SECTION_HOURLY = 4
+SECTION_WEEKLY = 5
+
+_SQL_OVERVIEW = f"""
+    SELECT {SECTION_OVERVIEW}, NULL, NULL,
+        CAST(COALESCE(SUM(CASE WHEN date > CURDATE() - INTERVAL %s DAY
+                 THEN bookings ELSE 0 END), 0) AS SIGNED),
+        COALESCE(SUM(CASE WHEN date > CURDATE() - INTERVAL %s DAY
+                 THEN revenue ELSE 0 END), 0) + 0E0,
+        CAST(COALESCE(SUM(CASE WHEN date <= CURDATE() - INTERVAL %s DAY
+                 THEN bookings ELSE 0 END), 0) AS SIGNED),
+        0E0
+    FROM {ROLLUP_TABLE}
+    WHERE date > CURDATE() - INTERVAL %s DAY
+"""
+
+_SQL_REVENUE_BY_FACILITY = f"""
+    SELECT {SECTION_REVENUE_BY_FACILITY}, facility_id, NULL,
+        CAST(SUM(bookings) AS SIGNED), SUM(revenue) + 0E0, NULL,
+        -SUM(revenue) + 0E0
+    FROM {ROLLUP_TABLE}
+    WHERE date > CURDATE() - INTERVAL %s DAY
+    GROUP BY facility_id
+"""
+
+_SQL_REVENUE_BY_DATE = f"""
+    SELECT {SECTION_REVENUE_BY_DATE}, NULL, date,
+        NULL, SUM(revenue) + 0E0, NULL,
+        TO_DAYS(date) + 0E0
+    FROM {ROLLUP_TABLE}
+    WHERE date > CURDATE() - INTERVAL %s DAY
+    GROUP BY date
+"""
+
+_SQL_UTILIZATION = f"""
+    SELECT {SECTION_UTILIZATION}, facility_id, NULL,
+        CAST(SUM(bookings) AS SIGNED), ROUND(SUM(bookings) * 100E0 / (%s * 24), 2), NULL,
+        -SUM(bookings) + 0E0
+    FROM {ROLLUP_TABLE}
+    WHERE date > CURDATE() - INTERVAL %s DAY
+    GROUP BY facility_id
+"""
+
+_SQL_HOURLY = f"""
+    SELECT {SECTION_HOURLY}, hour, NULL,
+        CAST(SUM(bookings) AS SIGNED), NULL, NULL,
+        hour + 0E0
+    FROM {ROLLUP_TABLE}
+    WHERE date > CURDATE() - INTERVAL %s DAY
+    GROUP BY hour
+"""
+
+_SQL_WEEKLY = f"""
+    SELECT {SECTION_WEEKLY}, dow, NULL,
+        CAST(SUM(bookings) AS SIGNED), NULL, NULL,
+        dow + 0E0
+    FROM {ROLLUP_TABLE}
+    WHERE date > CURDATE() - INTERVAL %s DAY
+    GROUP BY dow
+"""
+
+
+def _overview_params(days: int) -> tuple:
+    return (days, days, days, days * 2)
+
+
+# (statement, params builder) for each branch of the union
+_ROLLUP_BATCH = [
+    (_SQL_OVERVIEW, _overview_params),
+    (_SQL_REVENUE_BY_FACILITY, lambda days: (days,)),
+    (_SQL_REVENUE_BY_DATE, lambda days: (days,)),
+    (_SQL_UTILIZATION, lambda days: (days, days)),
+    (_SQL_HOURLY, lambda days: (days,)),
+    (_SQL_WEEKLY, lambda days: (days,))
+]
+
+_SQL_ROLLUP_SECTIONS = (
+    'UNION ALL'.join(statement for statement, _ in _ROLLUP_BATCH)
+    + 'ORDER BY 1, 7\n'
+)
+
+
+def _rollup_params(days: int) -> tuple:
+    return tuple(param for _, build_params in _ROLLUP_BATCH
+                 for param in build_params(days))
+
+
+# Windows the dashboard offers. Each gets its own statement with the interval
+# inlined, so the planner sees constant date bounds; any other `days` value
+# stays parameterized.
+DASHBOARD_WINDOWS = frozenset({7, 30, 90, 365})
+
+
+@lru_cache(maxsize=32)
+def _inline_params(sql: str, params: tuple) -> str:
+    return sql % params
+
+
+def _specialize(sql: str, params: tuple, days) -> tuple:
+    """
+    Inline `params` into `sql` when `days` is an allowlisted window
+    
+    Only ever inlines integers derived from an allowlisted `days`, so no
+    caller-supplied text reaches the SQL.
+    
+    Returns:
+        (sql, params) ready for execute()
+    """
+    if type(days) is not int or days not in DASHBOARD_WINDOWS:
+        return sql, params
+    return _inline_params(sql, params), ()
+
+
+# Total, new and returning customers from one grouping pass over the
+# (created_at, customer_phone) index. MySQL has no approximate distinct
+# count, but counting the groups drops the separate COUNT(DISTINCT) sort
+# over the same rows.
+_SQL_CUSTOMERS = """
+    SELECT 
+        COUNT(*) as total_customers,
+        CAST(COALESCE(SUM(booking_count = 1), 0) AS SIGNED) as new_customers,
+        CAST(COALESCE(SUM(booking_count > 1), 0) AS SIGNED) as returning_customers
+    FROM (
+        SELECT customer_phone, COUNT(*) as booking_count
+        FROM bookings
+        WHERE created_at >= NOW() - INTERVAL %s DAY
+        AND customer_phone IS NOT NULL
+        GROUP BY customer_phone
+    ) as customer_bookings
+"""
+
+_SQL_VIP_CUSTOMERS = """
+    SELECT COUNT(*) as vip_count
+    FROM customers
+    WHERE tier IN ('VIP', 'Platinum')
+"""
+
+
 class AdvancedAnalytics:
     """
     Advanced analytics engine for comprehensive business insights
     """
     
-    def __init__(self, db_connection):
-        self.db = db_connection
+    def __init__(self, db_connection, read_db_connection=None):
+        """
+        Args:
+            db_connection: A DB-API connection, or a connection pool exposing
+                get_connection() (e.g. mysql.connector.pooling.MySQLConnectionPool).
+                With a pool, dashboard sections are queried concurrently.
+                For mysql.connector, create it with use_pure=False so rows are
+                decoded by the C extension; the dashboard SQL casts every
+                numeric column to an integer or double, so no Decimal values
+                reach Python.
+            read_db_connection: Optional connection or pool for a read replica.
+                Dashboard reads go there in READ ONLY, READ COMMITTED sessions;
+                db_connection keeps the rollup refresh and other writes.
+        """
+        self.pool, self.db = self._split_source(db_connection)
+        
+        if read_db_connection is None:
+            self.read_pool, self.read_db = self.pool, self.db
+        else:
+            self.read_pool, self.read_db = self._split_source(read_db_connection)
+        self._read_only_sessions = read_db_connection is not None
+    
+    @staticmethod
+    def _split_source(db_connection) -> tuple:
+        """Return (pool, connection) with exactly one of them set"""
+        if hasattr(db_connection, 'get_connection'):
+            return db_connection, None
+        return None, db_connection
     
-    def get_dashboard_metrics(self, days: int = 30) -> Dict:
+    @contextmanager
+    def _connection(self, read_only: bool = False):
         """
-        Get comprehensive dashboard metrics
+        Borrow a pooled connection (returned on exit) or use the shared one
         
         Args:
-            days: Number of days to analyze
+            read_only: Use the read replica, if one was configured
+        """
+        pool, db = (self.read_pool, self.read_db) if read_only else (self.pool, self.db)
+        
+        if pool is None:
+            conn = db
+        else:
+            conn = pool.get_connection()
+        
+        try:
+            if read_only and self._read_only_sessions:
+                _ensure_read_only_session(conn)
+            yield conn
+        finally:
+            if pool is not None:
+                conn.close()
+    
+    def refresh_rollup(self, days: int = 2) -> bool:
+        """
+        Recompute rollup rows for recently touched dates
+        
+        A date is rebuilt when it falls in the trailing `days` or when any
+        booking created on it was updated in that span, so a cancellation of
+        an older booking drops out of the aggregates on the next run.
+        
+        Args:
+            days: Look-back for new and updated bookings
             
         Returns:
-            Dictionary with all dashboard metrics
+            True if the rollup was refreshed
         """
         try:
-            return {
-                'overview': self._get_overview_metrics(days),
-                'revenue': self._get_revenue_metrics(days),
-                'customers': self._get_customer_metrics(days),
-                'facilities': self._get_facility_metrics(days),
-                'channels': self._get_channel_metrics(days),
-                'trends': self._get_trend_metrics(days)
-            }
+            with self._connection() as conn:
+                try:
+                    cursor = conn.cursor()
+                    
+                    cursor.execute("""
+                        SELECT DISTINCT DATE(created_at)
+                        FROM bookings
+                        WHERE updated_at >= NOW() - INTERVAL %s DAY
+                        AND created_at < CURDATE() - INTERVAL %s DAY
+                    """, (days, days))
+                    older_dates = [changed_date for changed_date, in cursor.fetchall()]
+                    
+                    cursor.execute(f"""
+                        DELETE FROM {ROLLUP_TABLE}
+                        WHERE date >= CURDATE() - INTERVAL %s DAY
+                    """, (days,))
+                    cursor.execute(
+                        _SQL_ROLLUP_INSERT.format(where="created_at >= CURDATE() - INTERVAL %s DAY"),
+                        (days,)
+                    )
+                    
+                    for changed_date in older_dates:
+                        cursor.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE date = %s", (changed_date,))
+                        cursor.execute(
+                            _SQL_ROLLUP_INSERT.format(
+                                where="created_at >= %s AND created_at < %s + INTERVAL 1 DAY"
+                            ),
+                            (changed_date, changed_date)
+                        )
+                    
+                    cursor.close()
+                    conn.commit()
+                    
+                    logger.info(f"Refreshed {ROLLUP_TABLE} for the last {days} days "
+                                f"and {len(older_dates)} older dates")
+                    self.invalidate_cache()
+                    return True
+                except Exception:
+                    conn.rollback()
+                    raise
+            
         except Exception as e:
-            logger.error(f"Error getting dashboard metrics: {e}")
-            return {}
+            logger.error(f"Error refreshing booking rollup: {e}")
+            return False
     
-    def _get_overview_metrics(self, days: int) -> Dict:
-        """Get overview metrics"""
-        try:
-            cursor = self.db.cursor(dictionary=True)
-            
-            # Total bookings
-            cursor.execute("""
-                SELECT COUNT(*) as total_bookings,
-                       SUM(price) as total_revenue,
-                       AVG(price) as avg_booking_value
-                FROM bookings
-                WHERE created_at >= NOW() - INTERVAL %s DAY
-                AND status = 'confirmed'
-            """, (days,))
-            overview = cursor.fetchone()
-            
-            # Booking growth
-            cursor.execute("""
-                SELECT COUNT(*) as previous_bookings
-                FROM bookings
-                WHERE created_at >= NOW() - INTERVAL %s DAY
-                AND created_at < NOW() - INTERVAL %s DAY
-                AND status = 'confirmed'
-            """, (days * 2, days))
-            previous = cursor.fetchone()
+    def invalidate_cache(self):
+        """Drop cached dashboard results (call after bookings change)"""
+        with _dashboard_cache_lock:
+            _dashboard_cache.clear()
+    
+    def get_dashboard_metrics(self, days: int = 30, refresh: bool = False) -> Dict:
+        """
+        Get comprehensive dashboard metrics
+        
+        Results are cached process-wide per `days` for DASHBOARD_CACHE_TTL
+        seconds; callers get their own copy.
+        
+        Args:
+            days: Number of days to analyze
+            refresh: Bypass the cache and re-query the database
             
-            cursor.close()
+        Returns:
+            Dictionary with all dashboard metrics
+        """
+        now = time.monotonic()
+        
+        if not refresh:
+            with _dashboard_cache_lock:
+                cached = _dashboard_cache.get(days)
+            if cached and cached[0] > now:
+                return copy.deepcopy(cached[1])
+        
+        metrics = self._query_dashboard_metrics(days)
+        
+        # Don't pin a failed section in the cache for the whole TTL
+        if metrics and all(metrics.values()):
+            with _dashboard_cache_lock:
+                if len(_dashboard_cache) >= DASHBOARD_CACHE_MAX_ENTRIES:
+                    oldest = min(_dashboard_cache, key=lambda key: _dashboard_cache[key][0])
+                    del _dashboard_cache[oldest]
+                _dashboard_cache[days] = (now + DASHBOARD_CACHE_TTL, copy.deepcopy(metrics), None)
+        
+        return metrics
+    
+    def get_dashboard_metrics_json(self, days: int = 30, refresh: bool = False) -> bytes:
+        """
+        Get dashboard metrics as an encoded JSON response body
+        
+        The bytes are cached alongside the metrics, so warm requests skip both
+        the queries and the encoding. Uses orjson when it is installed.
+        
+        Args:
+            days: Number of days to analyze
+            refresh: Bypass the cache and re-query the database
             
-            growth_rate = 0
-            if previous and previous['previous_bookings'] > 0:
-                growth_rate = ((overview['total_bookings'] - previous['previous_bookings']) / 
-                             previous['previous_bookings']) * 100
+        Returns:
+            UTF-8 JSON bytes
+        """
+        if not refresh:
+            with _dashboard_cache_lock:
+                cached = _dashboard_cache.get(days)
+            if cached and cached[0] > time.monotonic() and cached[2] is not None:
+                return cached[2]
+        
+        metrics = self.get_dashboard_metrics(days, refresh=refresh)
+        body = _dumps(metrics)
+        
+        with _dashboard_cache_lock:
+            cached = _dashboard_cache.get(days)
+            if cached and cached[1] == metrics:
+                _dashboard_cache[days] = (cached[0], cached[1], body)
+        
+        return body
+    
+    def _query_dashboard_metrics(self, days: int) -> Dict:
+        """Run every dashboard section against the database"""
+        try:
+            # Two round-trips: every rollup section batched together, plus the
+            # raw-table customer queries. A single shared connection can't
+            # serve cursors from several threads, so only overlap them on a pool.
+            if self.read_pool is None:
+                rollup = self._get_rollup_sections(days)
+                customers = self._get_customer_metrics(days)
+            else:
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    rollup_future = executor.submit(self._get_rollup_sections, days)
+                    customers_future = executor.submit(self._get_customer_metrics, days)
+                    rollup = rollup_future.result()
+                    customers = customers_future.result()
             
             return {
-                'total_bookings': overview['total_bookings'] or 0,
-                'total_revenue': float(overview['total_revenue'] or 0),
-                'avg_booking_value': float(overview['avg_booking_value'] or 0),
-                'growth_rate': round(growth_rate, 2)
+                'overview': rollup['overview'],
+                'revenue': rollup['revenue'],
+                'customers': customers,
+                'facilities': rollup['facilities'],
+                'channels': self._get_channel_metrics(days),
+                'trends': rollup['trends']
             }
             
         except Exception as e:
-            logger.error(f"Error getting overview metrics: {e}")
+            logger.error(f"Error getting dashboard metrics: {e}")
             return {}
     
-    def _get_revenue_metrics(self, days: int) -> Dict:
-        """Get revenue analytics"""
+    def _get_rollup_sections(self, days: int) -> Dict:
+        """Fetch every rollup-backed section in a single round-trip"""
         try:
-            cursor = self.db.cursor(dictionary=True)
-            
-            # Revenue by facility
-            cursor.execute("""
-                SELECT facility_id, SUM(price) as revenue, COUNT(*) as bookings
-                FROM bookings
-                WHERE created_at >= NOW() - INTERVAL %s DAY
-                AND status = 'confirmed'
-                GROUP BY facility_id
-                ORDER BY revenue DESC
-            """, (days,))
-            by_facility = cursor.fetchall()
-            
-            # Revenue by day
-            cursor.execute("""
-                SELECT DATE(created_at) as date, SUM(price) as revenue
-                FROM bookings
-                WHERE created_at >= NOW() - INTERVAL %s DAY
-                AND status = 'confirmed'
-                GROUP BY DATE(created_at)
-                ORDER BY date
-            """, (days,))
-            by_date = cursor.fetchall()
-            
-            cursor.close()
+            overview = (0, 0.0, 0)
+            by_facility, by_date, utilization, hourly, weekly = [], [], [], [], []
+            
+            with self._connection(read_only=True) as conn:
+                # Prepared cursors are unbuffered, so by_date (one row per
+                # day) streams through fetchmany instead of being buffered
+                sql, params = _specialize(_SQL_ROLLUP_SECTIONS, _rollup_params(days), days)
+                try:
+                    cursor = _execute_prepared(conn, sql, params)
+                    
+                    for section, key_int, key_date, bookings, amount, previous, _ in _iter_rows(cursor):
+                        if section == SECTION_OVERVIEW:
+                            overview = (bookings, amount, previous)
+                        elif section == SECTION_REVENUE_BY_FACILITY:
+                            by_facility.append((key_int, amount, bookings))
+                        elif section == SECTION_REVENUE_BY_DATE:
+                            by_date.append((key_date, amount))
+                        elif section == SECTION_UTILIZATION:
+                            utilization.append((key_int, bookings, amount))
+                        elif section == SECTION_HOURLY:
+                            hourly.append((key_int, bookings))
+                        elif section == SECTION_WEEKLY:
+                            weekly.append((key_int, bookings))
+                except Exception:
+                    # Drains and closes, so the connection isn't left with unread rows
+                    _discard_prepared_cursor(conn, sql)
+                    raise
             
             return {
-                'by_facility': by_facility,
-                'by_date': [{'date': str(row['date']), 'revenue': float(row['revenue'])} 
-                           for row in by_date]
+                'overview': self._format_overview(overview),
+                'revenue': self._format_revenue(by_facility, by_date),
+                'facilities': self._format_facility(utilization),
+                'trends': self._format_trends(hourly, weekly)
             }
             
         except Exception as e:
-            logger.error(f"Error getting revenue metrics: {e}")
-            return {}
+            logger.error(f"Error getting rollup metrics: {e}")
+            return {'overview': {}, 'revenue': {}, 'facilities': {}, 'trends': {}}
+    
+    @staticmethod
+    def _format_overview(row) -> Dict:
+        """Shape the overview row into the dashboard payload"""
+        total_bookings, total_revenue, previous_bookings = row
+        
+        growth_rate = 0
+        if previous_bookings > 0:
+            growth_rate = ((total_bookings - previous_bookings) / 
+                         previous_bookings) * 100
+        
+        return {
+            'total_bookings': total_bookings,
+            'total_revenue': total_revenue,
+            'avg_booking_value': total_revenue / total_bookings if total_bookings else 0.0,
+            'growth_rate': round(growth_rate, 2)
+        }
+    
+    @staticmethod
+    def _format_revenue(by_facility, by_date) -> Dict:
+        """Shape revenue rows into the dashboard payload"""
+        return {
+            'by_facility': [
+                {
+                    'facility_id': facility_id,
+                    'revenue': revenue,
+                    'bookings': bookings
+                }
+                for facility_id, revenue, bookings in by_facility
+            ],
+            'by_date': [{'date': str(date), 'revenue': revenue} 
+                        for date, revenue in by_date]
+        }
     
     def _get_customer_metrics(self, days: int) -> Dict:
-        """Get customer analytics"""
+        """Get customer analytics (per-customer counts need the raw bookings table)"""
         try:
-            cursor = self.db.cursor(dictionary=True)
-            
-            # Total customers
-            cursor.execute("""
-                SELECT COUNT(DISTINCT customer_phone) as total_customers
-                FROM bookings
-                WHERE created_at >= NOW() - INTERVAL %s DAY
-            """, (days,))
-            total = cursor.fetchone()
-            
-            # New vs returning
-            cursor.execute("""
-                SELECT 
-                    SUM(CASE WHEN booking_count = 1 THEN 1 ELSE 0 END) as new_customers,
-                    SUM(CASE WHEN booking_count > 1 THEN 1 ELSE 0 END) as returning_customers
-                FROM (
-                    SELECT customer_phone, COUNT(*) as booking_count
-                    FROM bookings
-                    WHERE created_at >= NOW() - INTERVAL %s DAY
-                    GROUP BY customer_phone
-                ) as customer_bookings
-            """, (days,))
-            breakdown = cursor.fetchone()
-            
-            # VIP customers
-            cursor.execute("""
-                SELECT COUNT(*) as vip_count
-                FROM customers
-                WHERE tier IN ('VIP', 'Platinum')
-            """)
-            vip = cursor.fetchone()
-            
-            cursor.close()
+            with self._connection(read_only=True) as conn:
+                sql, params = _specialize(_SQL_CUSTOMERS, (days,), days)
+                try:
+                    cursor = _execute_prepared(conn, sql, params)
+                    (total_customers, new_customers, returning_customers), = cursor.fetchall()
+                    
+                    cursor = _execute_prepared(conn, _SQL_VIP_CUSTOMERS, ())
+                    (vip_count,), = cursor.fetchall()
+                except Exception:
+                    _discard_prepared_cursor(conn, sql)
+                    _discard_prepared_cursor(conn, _SQL_VIP_CUSTOMERS)
+                    raise
             
             return {
-                'total_customers': total['total_customers'] or 0,
-                'new_customers': breakdown['new_customers'] or 0,
-                'returning_customers': breakdown['returning_customers'] or 0,
-                'vip_customers': vip['vip_count'] or 0
+                'total_customers': total_customers or 0,
+                'new_customers': new_customers,
+                'returning_customers': returning_customers,
+                'vip_customers': vip_count or 0
             }
             
         except Exception as e:
             logger.error(f"Error getting customer metrics: {e}")
             return {}
     
-    def _get_facility_metrics(self, days: int) -> Dict:
-        """Get facility utilization metrics"""
-        try:
-            cursor = self.db.cursor(dictionary=True)
-            
-            # Utilization by facility
-            cursor.execute("""
-                SELECT 
-                    facility_id,
-                    COUNT(*) as total_bookings,
-                    COUNT(*) * 100.0 / (%s * 24) as utilization_rate
-                FROM bookings
-                WHERE created_at >= NOW() - INTERVAL %s DAY
-                AND status = 'confirmed'
-                GROUP BY facility_id
-                ORDER BY utilization_rate DESC
-            """, (days, days))
-            utilization = cursor.fetchall()
-            
-            cursor.close()
-            
-            return {
-                'utilization': [
-                    {
-                        'facility_id': row['facility_id'],
-                        'bookings': row['total_bookings'],
-                        'utilization_rate': round(row['utilization_rate'], 2)
-                    }
-                    for row in utilization
-                ]
-            }
-            
-        except Exception as e:
-            logger.error(f"Error getting facility metrics: {e}")
-            return {}
+    @staticmethod
+    def _format_facility(utilization) -> Dict:
+        """Shape utilization rows into the dashboard payload"""
+        return {
+            'utilization': [
+                {
+                    'facility_id': facility_id,
+                    'bookings': total_bookings,
+                    'utilization_rate': utilization_rate
+                }
+                for facility_id, total_bookings, utilization_rate in utilization
+            ]
+        }
     
     def _get_channel_metrics(self, days: int) -> Dict:
         """Get multi-channel booking metrics"""
         try:
-            cursor = self.db.cursor(dictionary=True)
-            
             # Bookings by channel (this would require a channel field in bookings table)
-            # For now, return placeholder data
-            
-            cursor.close()
+            # For now, return placeholder data without borrowing a connection
             
             return {
                 'phone': 75,  # 75% of bookings via phone
@@ -229,49 +664,15 @@ class AdvancedAnalytics:
             logger.error(f"Error getting channel metrics: {e}")
             return {}
     
-    def _get_trend_metrics(self, days: int) -> Dict:
-        """Get trend analysis"""
-        try:
-            cursor = self.db.cursor(dictionary=True)
-            
-            # Hourly booking trends
-            cursor.execute("""
-                SELECT 
-                    EXTRACT(HOUR FROM start_time) as hour,
-                    COUNT(*) as bookings
-                FROM bookings
-                WHERE created_at >= NOW() - INTERVAL %s DAY
-                AND status = 'confirmed'
-                GROUP BY EXTRACT(HOUR FROM start_time)
-                ORDER BY hour
-            """, (days,))
-            hourly = cursor.fetchall()
-            
-            # Day of week trends
-            cursor.execute("""
-                SELECT 
-                    DAYOFWEEK(start_time) as day_of_week,
-                    COUNT(*) as bookings
-                FROM bookings
-                WHERE created_at >= NOW() - INTERVAL %s DAY
-                AND status = 'confirmed'
-                GROUP BY DAYOFWEEK(start_time)
-                ORDER BY day_of_week
-            """, (days,))
-            weekly = cursor.fetchall()
-            
-            cursor.close()
-            
-            return {
-                'hourly': [{'hour': int(row['hour']), 'bookings': row['bookings']} 
-                          for row in hourly],
-                'weekly': [{'day': row['day_of_week'], 'bookings': row['bookings']} 
-                          for row in weekly]
-            }
-            
-        except Exception as e:
-            logger.error(f"Error getting trend metrics: {e}")
-            return {}
+    @staticmethod
+    def _format_trends(hourly, weekly) -> Dict:
+        """Shape trend rows into the dashboard payload"""
+        return {
+            'hourly': [{'hour': hour, 'bookings': bookings} 
+                      for hour, bookings in hourly],
+            'weekly': [{'day': day_of_week, 'bookings': bookings} 
+                      for day_of_week, bookings in weekly]
+        }
     
     def get_custom_report(self, query_config: Dict) -> Dict:
         """
@@ -7,9 +7,11 @@ Background jobs for recurring bookings, waitlist notifications, and rebooking ca
 from .recurring_booking_creator import RecurringBookingCreatorJob
 from .waitlist_notifier import WaitlistNotifierJob
 from .rebooking_caller import RebookingCallerJob
+from .analytics_rollup_refresher import AnalyticsRollupRefresherJob
 
 __all__ = [
     'RecurringBookingCreatorJob',
     'WaitlistNotifierJob',
-    'RebookingCallerJob'
+    'RebookingCallerJob',
+    'AnalyticsRollupRefresherJob'
 ]
@@ -0,0 +1,42 @@
+"""
+Analytics Rollup Refresher Job - Phase 7
+Background job to keep the dashboard's daily booking rollup current
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AnalyticsRollupRefresherJob:
+    """Background job to recompute recent days of the booking rollup"""
+    
+    def __init__(self, analytics):
+        self.analytics = analytics
+    
+    def run(self, lookback_days=2):
+        """
+        Refresh the rollup for recent days (run hourly)
+        
+        Args:
+            lookback_days: How many trailing days of new and updated
+                bookings to fold in (the phase 7 migration backfills history)
+        
+        Returns:
+            dict: Refresh status
+        """
+        try:
+            refreshed = self.analytics.refresh_rollup(lookback_days)
+            
+            logger.info(f"Analytics rollup refresher job complete: refreshed={refreshed}")
+            
+            return {'refreshed': refreshed, 'days': lookback_days}
+            
+        except Exception as e:
+            logger.error(f"Error in analytics rollup refresher job: {str(e)}")
+            return {'error': str(e)}
+
+
+# Factory function
+def create_analytics_rollup_refresher_job(analytics):
+    return AnalyticsRollupRefresherJob(analytics)
@@ -149,6 +149,44 @@ CREATE TABLE IF NOT EXISTS analytics_snapshots (
     INDEX idx_date (snapshot_date)
 );
 
+-- Daily booking rollup (refreshed hourly, read by the analytics dashboard)
+CREATE TABLE IF NOT EXISTS bookings_daily_rollup (
+    date DATE NOT NULL,  -- DATE(bookings.created_at)
+    facility_id INT NOT NULL,
+    hour TINYINT NOT NULL,  -- bookings.start_hour
+    dow TINYINT NOT NULL,  -- bookings.start_dow
+    bookings INT DEFAULT 0,
+    revenue DECIMAL(12,2) DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (date, facility_id, hour, dow),
+    INDEX idx_rollup_facility (facility_id)
+);
+
+-- Track booking edits so the rollup refresh can rebuild the dates they touch
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_bookings_updated ON bookings(updated_at);
+
+-- Start hour/weekday stored once per row so rollup grouping can read them
+-- straight from an index instead of evaluating HOUR()/DAYOFWEEK() per row
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS start_hour TINYINT AS (HOUR(start_time)) STORED;
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS start_dow TINYINT AS (DAYOFWEEK(start_time)) STORED;
+
+-- Backfill the rollup from existing bookings (the hourly job keeps it current)
+INSERT INTO bookings_daily_rollup (date, facility_id, hour, dow, bookings, revenue)
+SELECT 
+    DATE(created_at),
+    facility_id,
+    start_hour,
+    start_dow,
+    COUNT(*),
+    COALESCE(SUM(price), 0)
+FROM bookings
+WHERE status = 'confirmed'
+GROUP BY DATE(created_at), facility_id, start_hour, start_dow
+ON DUPLICATE KEY UPDATE
+    bookings = VALUES(bookings),
+    revenue = VALUES(revenue);
+
 -- Update bookings table to add channel column if it doesn't exist
 ALTER TABLE bookings ADD COLUMN IF NOT EXISTS channel VARCHAR(20) DEFAULT 'phone';
 ALTER TABLE bookings ADD COLUMN IF NOT EXISTS language VARCHAR(5) DEFAULT 'en';
@@ -158,3 +196,8 @@ CREATE INDEX IF NOT EXISTS idx_bookings_channel ON bookings(channel);
 CREATE INDEX IF NOT EXISTS idx_bookings_language ON bookings(language);
 CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings(created_at);
 CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status);
+
+-- Covering indexes for the analytics rollup refresh and customer breakdown
+-- (applied here only; the app never runs DDL against bookings at runtime)
+CREATE INDEX IF NOT EXISTS idx_bookings_status_created ON bookings(status, created_at, facility_id, start_hour, start_dow, price);
+CREATE INDEX IF NOT EXISTS idx_bookings_created_phone ON bookings(created_at, customer_phone);
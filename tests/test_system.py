@@ -19,6 +19,8 @@ from nlu import SportsRentalNLU
 from pricing import PricingEngine
 from calendar_helper import CalendarHelper
 from escalation import EscalationHandler
+from analytics import advanced_dashboard
+from analytics.advanced_dashboard import AdvancedAnalytics
 
 class TestNLU:
     """Test Natural Language Understanding functionality."""
@@ -421,6 +423,160 @@ class TestIntegrationFlows:
         assert ncco[0]['action'] == 'talk'
         assert 'staff' in ncco[0]['text'].lower()
 
+class TestAdvancedAnalytics:
+    """Test dashboard metrics against a mocked database connection."""
+    
+    def setup_method(self):
+        self.cursor = MagicMock()
+        self.db = Mock(spec=['cursor', 'commit', 'rollback'])
+        self.db.cursor.return_value = self.cursor
+        self.analytics = AdvancedAnalytics(self.db)
+        self.analytics.invalidate_cache()
+    
+    def test_rollup_sections_mapping(self):
+        """Test each tagged union row lands in its dashboard section."""
+        rows = [
+            (advanced_dashboard.SECTION_OVERVIEW, None, None, 120, 3000.0, 100, 0.0),
+            (advanced_dashboard.SECTION_REVENUE_BY_FACILITY, 2, None, 70, 2000.0, None, -2000.0),
+            (advanced_dashboard.SECTION_REVENUE_BY_FACILITY, 1, None, 50, 1000.0, None, -1000.0),
+            (advanced_dashboard.SECTION_REVENUE_BY_DATE, None, datetime(2024, 1, 2).date(), None, 3000.0, None, 1.0),
+            (advanced_dashboard.SECTION_UTILIZATION, 2, None, 70, 9.72, None, -70.0),
+            (advanced_dashboard.SECTION_HOURLY, 18, None, 40, None, None, 18.0),
+            (advanced_dashboard.SECTION_WEEKLY, 7, None, 35, None, None, 7.0),
+        ]
+        self.cursor.fetchmany.side_effect = [rows, []]
+        
+        sections = self.analytics._get_rollup_sections(30)
+        
+        assert sections['overview'] == {
+            'total_bookings': 120,
+            'total_revenue': 3000.0,
+            'avg_booking_value': 25.0,
+            'growth_rate': 20.0
+        }
+        assert sections['revenue']['by_facility'] == [
+            {'facility_id': 2, 'revenue': 2000.0, 'bookings': 70},
+            {'facility_id': 1, 'revenue': 1000.0, 'bookings': 50}
+        ]
+        assert sections['revenue']['by_date'] == [{'date': '2024-01-02', 'revenue': 3000.0}]
+        assert sections['facilities'] == {
+            'utilization': [{'facility_id': 2, 'bookings': 70, 'utilization_rate': 9.72}]
+        }
+        assert sections['trends'] == {
+            'hourly': [{'hour': 18, 'bookings': 40}],
+            'weekly': [{'day': 7, 'bookings': 35}]
+        }
+        
+        # The prepared cursor is kept for the next load instead of re-preparing
+        self.cursor.fetchmany.side_effect = [rows, []]
+        self.analytics._get_rollup_sections(30)
+        self.db.cursor.assert_called_once_with(prepared=True)
+        self.cursor.close.assert_not_called()
+    
+    def test_rollup_cursor_closed_on_error(self):
+        """Test a failed batch still closes its cursor and returns empty sections."""
+        self.cursor.execute.side_effect = Exception("connection lost")
+        self.cursor.fetchmany.return_value = []
+        
+        sections = self.analytics._get_rollup_sections(30)
+        
+        assert sections == {'overview': {}, 'revenue': {}, 'facilities': {}, 'trends': {}}
+        assert self.cursor.close.called
+    
+    def test_customer_metrics(self):
+        """Test customer counts come from the grouped query and the VIP count."""
+        self.cursor.fetchall.side_effect = [[(12, 9, 3)], [(2,)]]
+        
+        customers = self.analytics._get_customer_metrics(30)
+        
+        assert customers == {
+            'total_customers': 12,
+            'new_customers': 9,
+            'returning_customers': 3,
+            'vip_customers': 2
+        }
+        assert 'COUNT(DISTINCT' not in self.cursor.execute.call_args_list[0][0][0]
+    
+    def test_reads_use_read_only_replica(self):
+        """Test dashboard reads go to the replica in a read-only session."""
+        replica_cursor = MagicMock()
+        replica_cursor.fetchall.side_effect = [[(12, 9, 3)], [(2,)]]
+        replica = Mock(spec=['cursor', 'commit', 'rollback'])
+        replica.cursor.return_value = replica_cursor
+        analytics = AdvancedAnalytics(self.db, read_db_connection=replica)
+        
+        analytics._get_customer_metrics(30)
+        analytics._get_customer_metrics(30)
+        
+        self.db.cursor.assert_not_called()
+        session_sets = [c for c in replica_cursor.execute.call_args_list
+                        if 'READ ONLY' in c[0][0]]
+        assert len(session_sets) == 1
+    
+    def test_format_overview_without_previous_period(self):
+        """Test growth rate and average value when there is nothing to compare."""
+        overview = AdvancedAnalytics._format_overview((0, 0.0, 0))
+        
+        assert overview['growth_rate'] == 0
+        assert overview['avg_booking_value'] == 0.0
+    
+    def test_growth_window_boundaries(self):
+        """Test an N-day window covers exactly N days, then the N before it."""
+        sql = advanced_dashboard._SQL_OVERVIEW
+        
+        assert sql.count('date > CURDATE() - INTERVAL %s DAY') == 3
+        assert sql.count('date <= CURDATE() - INTERVAL %s DAY') == 1
+        assert '>=' not in advanced_dashboard._SQL_ROLLUP_SECTIONS
+        assert advanced_dashboard._overview_params(30) == (30, 30, 30, 60)
+    
+    def test_sql_specialized_for_dashboard_windows(self):
+        """Test allowlisted windows inline the interval and others stay parameterized."""
+        sql, params = advanced_dashboard._specialize(advanced_dashboard._SQL_CUSTOMERS, (30,), 30)
+        assert params == ()
+        assert 'INTERVAL 30 DAY' in sql and '%s' not in sql
+        
+        sql, params = advanced_dashboard._specialize(advanced_dashboard._SQL_CUSTOMERS, (45,), 45)
+        assert params == (45,)
+        assert 'INTERVAL %s DAY' in sql
+        
+        _, params = advanced_dashboard._specialize(advanced_dashboard._SQL_CUSTOMERS, ('30',), '30')
+        assert params == ('30',)
+    
+    def test_dashboard_cache_expiry_and_refresh(self):
+        """Test cached results expire, refresh bypasses them and copies are returned."""
+        metrics = {'overview': {'total_bookings': 1}, 'revenue': {'by_date': []}}
+        
+        with patch.object(AdvancedAnalytics, '_query_dashboard_metrics',
+                          return_value=metrics) as mock_query, \
+             patch('analytics.advanced_dashboard.time.monotonic') as mock_clock:
+            mock_clock.return_value = 1000.0
+            first = self.analytics.get_dashboard_metrics(30)
+            first['overview']['total_bookings'] = 99
+            
+            # A fresh instance shares the cache and gets an untouched copy
+            second = AdvancedAnalytics(self.db).get_dashboard_metrics(30)
+            assert mock_query.call_count == 1
+            assert second['overview']['total_bookings'] == 1
+            
+            self.analytics.get_dashboard_metrics(30, refresh=True)
+            assert mock_query.call_count == 2
+            
+            mock_clock.return_value = 1000.0 + advanced_dashboard.DASHBOARD_CACHE_TTL + 1
+            self.analytics.get_dashboard_metrics(30)
+            assert mock_query.call_count == 3
+
+    def test_dashboard_json_is_cached(self):
+        """Test the encoded dashboard body is reused until the cache expires."""
+        metrics = {'overview': {'total_revenue': 12.5}, 'revenue': {'by_date': []}}
+        
+        with patch.object(AdvancedAnalytics, '_query_dashboard_metrics',
+                          return_value=metrics) as mock_query:
+            body = self.analytics.get_dashboard_metrics_json(30)
+            
+            assert json.loads(body) == metrics
+            assert self.analytics.get_dashboard_metrics_json(30) is body
+            assert mock_query.call_count == 1
+
 # Run tests
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])